@@ -1,15 +1,42 @@
-from fastapi import APIRouter, UploadFile, HTTPException, BackgroundTasks
+from fastapi import APIRouter, UploadFile, HTTPException, BackgroundTasks, Request
+from fastapi.routing import APIRoute
 from app.core.pdf_processor import PDFProcessor
+from app.api.endpoints.queries import rag_engine
 from app.models.document import DocumentResponse
-from typing import List
+from typing import Callable, List
 import os
 import logging
 
 logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", "10485760"))  # 10MB default
+
+def verify_size(request: Request):
+    """Reject uploads whose declared Content-Length exceeds MAX_UPLOAD_SIZE"""
+    try:
+        content_length = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+    if content_length > MAX_UPLOAD_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum size allowed is {MAX_UPLOAD_SIZE/1024/1024:.1f}MB"
+        )
+
+class UploadSizeLimitRoute(APIRoute):
+    """Route that runs verify_size before FastAPI reads the request body"""
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        
+        async def size_limited_handler(request: Request):
+            verify_size(request)
+            return await handler(request)
+        
+        return size_limited_handler
+
 router = APIRouter()
 pdf_processor = PDFProcessor()
 
-@router.post("/upload", response_model=DocumentResponse)
 async def upload_document(
     file: UploadFile,
     background_tasks: BackgroundTasks
@@ -30,6 +57,16 @@ async def upload_document(
         logger.error(f"Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Registered directly so the size check runs before the multipart body is parsed;
+# a Depends() would only run after FastAPI had already read the whole upload
+router.add_api_route(
+    "/upload",
+    upload_document,
+    methods=["POST"],
+    response_model=DocumentResponse,
+    route_class_override=UploadSizeLimitRoute
+)
+
 @router.get("/status/{document_id}")
 async def get_document_status(document_id: str):
     try:
@@ -41,12 +78,20 @@ async def get_document_status(document_id: str):
         logger.error(f"Status check error for {document_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _delete_vectors_and_invalidate(document_id: str):
+    """Remove a document's vectors, then drop retrievals cached while they still existed"""
+    await pdf_processor.delete_vectors(document_id)
+    rag_engine.invalidate(document_id)
+
 @router.delete("/{document_id}")
-async def delete_document(document_id: str):
+async def delete_document(document_id: str, background_tasks: BackgroundTasks):
     try:
-        success = await pdf_processor.delete_document(document_id)
+        # Status lookups 404 right away; vector store cleanup runs after the response
+        success = pdf_processor.forget_document(document_id)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to delete document")
+        rag_engine.invalidate(document_id)
+        background_tasks.add_task(_delete_vectors_and_invalidate, document_id)
         return {"message": "Document deleted successfully"}
     except Exception as e:
         logger.error(f"Delete error for {document_id}: {str(e)}")
@@ -1,57 +1,145 @@
 from fastapi import APIRouter, BackgroundTasks
 from typing import Dict, List
-import psutil
 import torch
 import time
 import asyncio
-from collections import deque
+import numpy as np
 import logging
+from app.utils.monitoring import system_monitor
+from app.core.torch_config import CUDA_AVAILABLE
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 # Keep last 60 minutes of metrics, one sample per minute
 MAX_HISTORY = 60
-metrics_history = deque(maxlen=MAX_HISTORY)
+METRICS_INTERVAL = 60  # Seconds between history samples taken by collect_metrics
+
+# Columns of a stored history sample
+METRIC_FIELDS = (
+    "timestamp",
+    "cpu_percent",
+    "memory_total",
+    "memory_available",
+    "memory_percent",
+    "gpu_memory_allocated",
+    "gpu_memory_reserved",
+    "gpu_utilization_mean",
+    "gpu_utilization_max",
+)
+
+# Device count doesn't change at runtime; query it once
+_CUDA_DEVS = torch.cuda.device_count() if CUDA_AVAILABLE else 0
+
+# Coalesce bursty /metrics requests onto one GPU sample per second
+GPU_METRICS_TTL = 1.0
+_gpu_metrics_cache: Dict = {}
+_gpu_metrics_time = 0.0
+
+def _get_gpu_metrics() -> Dict:
+    """Return dynamic GPU metrics, resampled at most once per GPU_METRICS_TTL"""
+    global _gpu_metrics_cache, _gpu_metrics_time
+    
+    now = time.monotonic()
+    if not _gpu_metrics_cache or now - _gpu_metrics_time >= GPU_METRICS_TTL:
+        if CUDA_AVAILABLE:
+            _gpu_metrics_cache = {
+                "gpu_memory_allocated": torch.cuda.memory_allocated() / (1024 * 1024),
+                "gpu_memory_reserved": torch.cuda.memory_reserved() / (1024 * 1024),
+                "gpu_utilization": [torch.cuda.utilization(i) for i in range(_CUDA_DEVS)]
+            }
+        else:
+            _gpu_metrics_cache = {
+                "gpu_memory_allocated": 0,
+                "gpu_memory_reserved": 0,
+                "gpu_utilization": []
+            }
+        _gpu_metrics_time = now
+    return _gpu_metrics_cache
 
 class SystemMetrics:
     def __init__(self):
         self.timestamp = time.time()
-        self.cpu_percent = psutil.cpu_percent(interval=None)
-        self.memory = psutil.virtual_memory()._asdict()
-        self.memory_percent = psutil.Process().memory_percent()
+        # Read the monitor's 1 Hz sample; a second cpu_percent() caller would reset
+        # psutil's shared baseline and both would measure only the gap between calls
+        cached = system_monitor.cached_stats
+        self.cpu_percent = cached["cpu"]
+        self.memory_total = cached["mem"]["total"]
+        self.memory_available = cached["mem"]["available"]
+        self.memory_percent = cached["proc_mem_percent"]
         
-        if torch.cuda.is_available():
-            self.gpu_memory_allocated = torch.cuda.memory_allocated() / (1024 * 1024)
-            self.gpu_memory_reserved = torch.cuda.memory_reserved() / (1024 * 1024)
-            self.gpu_utilization = [torch.cuda.utilization(i) for i in range(torch.cuda.device_count())]
-        else:
-            self.gpu_memory_allocated = 0
-            self.gpu_memory_reserved = 0
-            self.gpu_utilization = []
+        gpu_metrics = _get_gpu_metrics()
+        self.gpu_memory_allocated = gpu_metrics["gpu_memory_allocated"]
+        self.gpu_memory_reserved = gpu_metrics["gpu_memory_reserved"]
+        self.gpu_utilization = gpu_metrics["gpu_utilization"]
 
     def to_dict(self) -> Dict:
         return {
             "timestamp": self.timestamp,
             "cpu_percent": self.cpu_percent,
-            "memory_total": self.memory["total"] / (1024 * 1024),  # MB
-            "memory_available": self.memory["available"] / (1024 * 1024),  # MB
+            "memory_total": self.memory_total / (1024 * 1024),  # MB
+            "memory_available": self.memory_available / (1024 * 1024),  # MB
             "memory_percent": self.memory_percent,
             "gpu_memory_allocated": self.gpu_memory_allocated,
             "gpu_memory_reserved": self.gpu_memory_reserved,
             "gpu_utilization": self.gpu_utilization
         }
 
+    def to_row(self) -> List[float]:
+        """Flatten into a history row ordered like METRIC_FIELDS"""
+        return [
+            self.timestamp,
+            self.cpu_percent,
+            self.memory_total / (1024 * 1024),  # MB
+            self.memory_available / (1024 * 1024),  # MB
+            self.memory_percent,
+            self.gpu_memory_allocated,
+            self.gpu_memory_reserved,
+            float(np.mean(self.gpu_utilization)) if self.gpu_utilization else 0.0,
+            float(max(self.gpu_utilization)) if self.gpu_utilization else 0.0,
+        ]
+
+class MetricsHistory:
+    """Fixed-size ring buffer of metric samples"""
+    def __init__(self, max_history: int):
+        self._ring = np.zeros((max_history, len(METRIC_FIELDS)), dtype=np.float64)
+        self._ring_len = 0
+        self._ring_head = 0  # Next row to write
+    
+    def __len__(self) -> int:
+        return self._ring_len
+    
+    def append(self, metrics: SystemMetrics):
+        self._ring[self._ring_head] = metrics.to_row()
+        self._ring_head = (self._ring_head + 1) % len(self._ring)
+        self._ring_len = min(self._ring_len + 1, len(self._ring))
+    
+    def to_list(self) -> List[Dict]:
+        """Return samples oldest first"""
+        if self._ring_len < len(self._ring):
+            rows = self._ring[:self._ring_len]
+        else:
+            rows = np.concatenate((self._ring[self._ring_head:], self._ring[:self._ring_head]))
+        return [dict(zip(METRIC_FIELDS, row)) for row in rows.tolist()]
+    
+    def clear(self):
+        self._ring_len = 0
+        self._ring_head = 0
+
+metrics_history = MetricsHistory(MAX_HISTORY)
+
 async def collect_metrics():
     """Background task to collect system metrics"""
+    # Schedule against the monotonic clock so sampling time doesn't add drift
+    next_sample = time.monotonic()
     while True:
         try:
             metrics = SystemMetrics()
-            metrics_history.append(metrics.to_dict())
-            await asyncio.sleep(60)  # Collect every minute
+            metrics_history.append(metrics)
         except Exception as e:
             logger.error(f"Error collecting metrics: {str(e)}")
-            await asyncio.sleep(60)  # Wait before retry
+        next_sample += METRICS_INTERVAL  # Collect every minute
+        await asyncio.sleep(max(0.0, next_sample - time.monotonic()))
 
 @router.get("/metrics")
 async def get_metrics(background_tasks: BackgroundTasks) -> Dict:
@@ -64,13 +152,13 @@ async def get_metrics(background_tasks: BackgroundTasks) -> Dict:
     
     return {
         "current": current_metrics.to_dict(),
-        "history": list(metrics_history)
+        "history": metrics_history.to_list()
     }
 
 @router.get("/metrics/history")
 async def get_metrics_history() -> List[Dict]:
     """Get historical system metrics"""
-    return list(metrics_history)
+    return metrics_history.to_list()
 
 @router.post("/metrics/clear")
 async def clear_metrics_history():
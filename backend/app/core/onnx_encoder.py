@@ -0,0 +1,91 @@
+import numpy as np
+from pathlib import Path
+from typing import List
+import logging
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_FILE = "model_quantized.onnx"
+
+def export_quantized_encoder(model_name: str, save_dir: Path) -> None:
+    """Export a sentence-transformers model to ONNX and quantize it to int8"""
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    logger.info(f"Exporting {model_name} to ONNX in {save_dir}")
+    save_dir.mkdir(parents=True, exist_ok=True)
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(save_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(save_dir)
+
+    # Dynamic int8 quantization; uses VNNI GEMMs where the CPU supports them
+    quantizer = ORTQuantizer.from_pretrained(save_dir)
+    quantizer.quantize(
+        save_dir=save_dir,
+        quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    )
+
+class OnnxEncoder:
+    """Int8 ONNX Runtime sentence encoder with SentenceTransformer's encode() API"""
+    def __init__(self, model_name: str, model_dir: Path, max_seq_length: int = 256):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        if not (model_dir / ONNX_MODEL_FILE).exists():
+            export_quantized_encoder(model_name, model_dir)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = max_seq_length
+        self.session = ort.InferenceSession(
+            str(model_dir / ONNX_MODEL_FILE),
+            providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        logger.info(f"Loaded quantized ONNX encoder from {model_dir}")
+
+    def encode(
+        self,
+        sentences: List[str],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+        **kwargs
+    ) -> np.ndarray:
+        # Batch in length order so each batch pads to similar lengths
+        order = np.argsort([-len(sentence) for sentence in sentences], kind="stable")
+        sorted_sentences = [sentences[i] for i in order]
+
+        all_embeddings = []
+        for i in range(0, len(sorted_sentences), batch_size):
+            features = self.tokenizer(
+                sorted_sentences[i:i + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            inputs = {
+                name: value.astype(np.int64)
+                for name, value in features.items()
+                if name in self._input_names
+            }
+            token_embeddings = self.session.run(None, inputs)[0]
+
+            # Mean pooling over non-padding tokens
+            mask = features["attention_mask"][..., None].astype(np.float32)
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+            if normalize_embeddings:
+                embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+            all_embeddings.append(embeddings.astype(np.float32))
+
+        if not all_embeddings:
+            return np.empty((0, self.session.get_outputs()[0].shape[-1]), dtype=np.float32)
+
+        # Restore input order
+        sorted_embeddings = np.vstack(all_embeddings)
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings
@@ -1,14 +1,19 @@
-import PyPDF2
+import aiofiles
+import pypdfium2 as pdfium
 from pathlib import Path
 import uuid
 import asyncio
-from typing import List, Dict
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Callable, AsyncIterator, Tuple
 import spacy
 import logging
 from datetime import datetime
 import os
-from app.core.vector_store import VectorStore
-from app.models.document import DocumentChunk
+from app.core.vector_store import get_vector_store
+from app.models.document import StoredChunk
+from app.utils.progress import ProgressThrottle
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +22,119 @@ MAX_PAGES = int(os.getenv("MAX_PAGES", "1000"))
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))
+PAGE_BATCH_SIZE = int(os.getenv("PAGE_BATCH_SIZE", "16"))
+# Page batches submitted to the pool but not yet handed to the indexer
+MAX_PAGE_BATCHES_IN_FLIGHT = int(os.getenv("MAX_PAGE_BATCHES_IN_FLIGHT", str(2 * (os.cpu_count() or 1))))
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1MB
+
+# Shared pool for text extraction and chunking; keeps CPU-bound work off the event loop
+_page_executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+
+# Sentence splitter, created on first use in each worker process
+_nlp = None
+
+def _get_nlp():
+    global _nlp
+    if _nlp is None:
+        # Only sentence boundaries are needed, so skip the statistical pipeline
+        _nlp = spacy.blank("en")
+        _nlp.add_pipe("sentencizer")
+    return _nlp
+
+def _extract_pages(path: str, start: int, stop: int) -> List[str]:
+    """Extract the text of pages [start, stop)"""
+    pdf = pdfium.PdfDocument(path)
+    try:
+        texts = []
+        for page_num in range(start, stop):
+            try:
+                texts.append(pdf[page_num].get_textpage().get_text_range())
+            except Exception as e:
+                logger.warning(f"Error extracting page {page_num}: {str(e)}")
+                texts.append("")
+        return texts
+    finally:
+        pdf.close()
+
+def _create_chunks_from_doc(doc, page_num: int, chunk_size: int, chunk_overlap: int) -> List[StoredChunk]:
+    """Group the sentences of a parsed page into overlapping chunks"""
+    chunks = []
+    
+    # (sentence, length) pairs; a deque keeps overlap rebuilding O(1) per sentence
+    current_chunk = deque()
+    current_length = 0
+    chunk_id = 0
+    
+    for para in doc.sents:
+        para_text = para.text.strip()
+        if not para_text:
+            continue
+        para_length = len(para_text)
+    
+        # If adding this paragraph would exceed chunk size, save current chunk
+        if current_length + para_length > chunk_size and current_chunk:
+            chunk_text = " ".join(text for text, _ in current_chunk)
+            chunks.append(StoredChunk(
+                chunk_id=f"{page_num}-{chunk_id}",
+                text=chunk_text,
+                page_number=page_num,
+                metadata={
+                    "position": chunk_id,
+                    "length": len(chunk_text),
+                    "page": page_num
+                }
+            ))
+            chunk_id += 1
+    
+            # Keep last paragraph for overlap
+            overlap_size = 0
+            overlap_chunk = deque()
+            for text, length in reversed(current_chunk):
+                if overlap_size + length > chunk_overlap:
+                    break
+                overlap_chunk.appendleft((text, length))
+                overlap_size += length
+    
+            current_chunk = overlap_chunk
+            current_length = overlap_size
+    
+        current_chunk.append((para_text, para_length))
+        current_length += para_length
+    
+    # Don't forget the last chunk
+    if current_chunk:
+        chunk_text = " ".join(text for text, _ in current_chunk)
+        chunks.append(StoredChunk(
+            chunk_id=f"{page_num}-{chunk_id}",
+            text=chunk_text,
+            page_number=page_num,
+            metadata={
+                "position": chunk_id,
+                "length": len(chunk_text),
+                "page": page_num
+            }
+        ))
+    
+    return chunks
+
+def _process_pages(path: str, start: int, stop: int, chunk_size: int, chunk_overlap: int) -> List[StoredChunk]:
+    """Extract and chunk pages [start, stop) in a worker process"""
+    texts = _extract_pages(path, start, stop)
+    
+    # Only process non-empty pages, tokenizing them in one batched pipe
+    pages = [(text, page_num) for page_num, text in enumerate(texts, start) if text.strip()]
+    docs = _get_nlp().pipe((text for text, _ in pages), batch_size=32, n_process=1)
+    
+    chunks = []
+    for (_, page_num), doc in zip(pages, docs):
+        try:
+            page_chunks = _create_chunks_from_doc(doc, page_num, chunk_size, chunk_overlap)
+            chunks.extend(page_chunks)
+            logger.debug(f"Processed page {page_num + 1} with {len(page_chunks)} chunks")
+        except Exception as e:
+            logger.warning(f"Error processing page {page_num}: {str(e)}")
+            continue
+    return chunks
 
 class PDFProcessingError(Exception):
     """Base exception for PDF processing errors"""
@@ -34,37 +152,48 @@ class EmptyDocumentError(PDFProcessingError):
     """Raised when no text content could be extracted"""
     pass
 
+@dataclass
+class DocState:
+    """Processing state of a single document"""
+    __slots__ = ("status", "metadata", "progress")
+    
+    status: str
+    metadata: Dict[str, Any]
+    progress: float
+
 class PDFProcessor:
     def __init__(self):
         self.upload_dir = Path("uploads")
         self.upload_dir.mkdir(exist_ok=True)
-        self.nlp = spacy.load("en_core_web_sm")
-        self.vector_store = VectorStore()
-        self.processing_status = {}
-        self.document_metadata = {}
+        self.vector_store = get_vector_store()
+        self.docs: Dict[str, DocState] = {}
         self.chunk_size = CHUNK_SIZE
         self.chunk_overlap = CHUNK_OVERLAP
 
     async def _update_processing_progress(self, document_id: str, message: str, progress: float):
         """Update processing status with progress information"""
-        self.processing_status[document_id] = f"processing: {message} ({progress:.0%})"
-        if document_id in self.document_metadata:
-            self.document_metadata[document_id]["processing_progress"] = progress
+        state = self.docs.get(document_id)
+        if state:
+            state.status = f"processing: {message} ({progress:.0%})"
+            state.progress = progress
 
     async def save_document(self, file) -> str:
         document_id = str(uuid.uuid4())
         file_path = self.upload_dir / f"{document_id}.pdf"
         
         try:
-            with open(file_path, "wb") as f:
-                content = await file.read()
-                f.write(content)
+            # Stream the upload to disk instead of buffering it in memory
+            file_size = 0
+            async with aiofiles.open(file_path, "wb") as f:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
+                    file_size += len(chunk)
             
             # Initialize metadata
-            self.document_metadata[document_id] = {
+            metadata = {
                 "filename": file.filename,
                 "processed_at": datetime.utcnow().isoformat(),
-                "file_size": len(content),
+                "file_size": file_size,
                 "chunk_count": 0,
                 "total_pages": 0,
                 "configuration": {
@@ -76,53 +205,51 @@ class PDFProcessor:
             
             # Validate PDF is readable and extract metadata
             try:
-                with open(file_path, "rb") as f:
-                    try:
-                        reader = PyPDF2.PdfReader(f)
-                        total_pages = len(reader.pages)
-                        
-                        # Check if PDF is empty
-                        if total_pages == 0:
-                            raise PDFCorruptedError("PDF file contains no pages")
-                        
-                        # Check if PDF is too large
-                        if total_pages > MAX_PAGES:
-                            raise PDFCorruptedError(f"PDF file too large (max {MAX_PAGES} pages)")
-                            
-                        # Try to extract text from first page to validate content
-                        first_page_text = reader.pages[0].extract_text().strip()
-                        if not first_page_text:
-                            raise PDFCorruptedError("First page contains no extractable text")
-                        
-                        # Get PDF metadata if available
-                        pdf_info = reader.metadata
-                        if pdf_info:
-                            self.document_metadata[document_id]["pdf_metadata"] = {
-                                "title": pdf_info.get("/Title", ""),
-                                "author": pdf_info.get("/Author", ""),
-                                "subject": pdf_info.get("/Subject", ""),
-                                "creator": pdf_info.get("/Creator", ""),
-                                "creation_date": pdf_info.get("/CreationDate", ""),
-                            }
-                        
-                        # Update page count
-                        self.document_metadata[document_id]["total_pages"] = total_pages
-                        
-                    except Exception as e:
-                        raise PDFCorruptedError(f"Invalid or corrupted PDF file: {str(e)}")
+                pdf = pdfium.PdfDocument(str(file_path))
+                try:
+                    total_pages = len(pdf)
+                    
+                    # Check if PDF is empty
+                    if total_pages == 0:
+                        raise PDFCorruptedError("PDF file contains no pages")
+                    
+                    # Check if PDF is too large
+                    if total_pages > MAX_PAGES:
+                        raise PDFCorruptedError(f"PDF file too large (max {MAX_PAGES} pages)")
+                    
+                    # Text content isn't checked here; documents without any are
+                    # rejected with EmptyDocumentError during processing
+                    
+                    # Get PDF metadata if available
+                    pdf_info = pdf.get_metadata_dict()
+                    if pdf_info:
+                        metadata["pdf_metadata"] = {
+                            "title": pdf_info.get("Title", ""),
+                            "author": pdf_info.get("Author", ""),
+                            "subject": pdf_info.get("Subject", ""),
+                            "creator": pdf_info.get("Creator", ""),
+                            "creation_date": pdf_info.get("CreationDate", ""),
+                        }
+                    
+                    # Update page count so extraction doesn't need to re-count
+                    metadata["total_pages"] = total_pages
+                    
+                except Exception as e:
+                    raise PDFCorruptedError(f"Invalid or corrupted PDF file: {str(e)}")
+                finally:
+                    pdf.close()
                         
             except Exception as e:
                 raise PDFCorruptedError(f"Failed to validate PDF: {str(e)}")
             
-            self.processing_status[document_id] = "uploaded"
+            self.docs[document_id] = DocState(status="uploaded", metadata=metadata, progress=0.0)
             logger.info(f"Document {document_id} saved and validated successfully")
             return document_id
             
         except Exception as e:
             if file_path.exists():
                 file_path.unlink()
-            if document_id in self.document_metadata:
-                del self.document_metadata[document_id]
+            self.docs.pop(document_id, None)
             if isinstance(e, PDFProcessingError):
                 raise
             raise PDFProcessingError(f"Failed to save document: {str(e)}")
@@ -138,9 +265,10 @@ class PDFProcessor:
                 error_msg = f"Error processing document (attempt {retry_count}/{MAX_RETRIES}): {str(e)}"
                 logger.error(error_msg)
                 if retry_count >= MAX_RETRIES:
-                    self.processing_status[document_id] = f"error: {str(e)}"
-                    if document_id in self.document_metadata:
-                        self.document_metadata[document_id]["error"] = str(e)
+                    state = self.docs.get(document_id)
+                    if state:
+                        state.status = f"error: {str(e)}"
+                        state.metadata["error"] = str(e)
                     await self.delete_document(document_id)
                     raise PDFProcessingError(error_msg)
                 await asyncio.sleep(1)  # Wait before retrying
@@ -154,165 +282,170 @@ class PDFProcessor:
             if not file_path.exists():
                 raise FileNotFoundError(f"PDF file not found for document {document_id}")
             
-            # Extract text from PDF
+            # Extract text from PDF and index chunks as they are produced
             await self._update_processing_progress(document_id, "Extracting text", 0.2)
-            chunks = await self._extract_text(file_path)
+            state = self.docs[document_id]
+            extracted = 0.0
             
-            if not chunks:
-                raise EmptyDocumentError("No text content could be extracted from the PDF")
+            async def report_extraction(message: str, progress: float):
+                nonlocal extracted
+                extracted = progress
+                # Extraction paces encoding from 20% to 80%
+                await self._update_processing_progress(document_id, message, 0.2 + progress * 0.6)
             
-            # Update metadata before indexing
-            self.document_metadata[document_id].update({
-                "chunk_count": len(chunks),
-                "average_chunk_length": sum(len(c.text) for c in chunks) / len(chunks)
-            })
+            async def report_indexing(message: str, progress: float):
+                if progress <= 0.7:
+                    # Encoding overlaps extraction and can only cover what has been
+                    # extracted, so scale it by extraction progress within 20-80%
+                    overall = 0.2 + 0.6 * extracted * progress / 0.7
+                else:
+                    overall = 0.3 + progress * 0.7  # Index build and save: 86-100%
+                await self._update_processing_progress(document_id, message, overall)
             
-            # Process and store chunks with progress tracking
-            await self.vector_store.add_chunks(
-                document_id, 
-                chunks,
-                progress_callback=lambda msg, prog: self._update_processing_progress(
-                    document_id,
-                    msg,
-                    0.3 + prog * 0.7  # Scale progress to remaining 70%
-                )
+            # Throttled so large documents don't flood progress consumers with updates
+            chunks = await self.vector_store.add_chunks_stream(
+                document_id,
+                self._extract_text(
+                    file_path,
+                    total_pages=state.metadata.get("total_pages"),
+                    progress_callback=ProgressThrottle(report_extraction)
+                ),
+                progress_callback=ProgressThrottle(report_indexing)
             )
             
-            # Update final metadata
-            self.document_metadata[document_id].update({
-                "completed_at": datetime.utcnow().isoformat(),
-                "processing_progress": 1.0
+            state.metadata.update({
+                "chunk_count": len(chunks),
+                "average_chunk_length": sum(len(c.text) for c in chunks) / len(chunks)
             })
             
-            self.processing_status[document_id] = "completed"
+            # Update final metadata
+            state.metadata["completed_at"] = datetime.utcnow().isoformat()
+            state.progress = 1.0
+            state.status = "completed"
             logger.info(f"Document {document_id} processed successfully with {len(chunks)} chunks")
             
         except Exception as e:
             logger.error(f"Error in _process_document_internal: {str(e)}")
             raise
 
+    def _delete_file_and_state(self, document_id: str) -> None:
+        """Delete the PDF file and in-memory state of a document"""
+        file_path = self.upload_dir / f"{document_id}.pdf"
+        if file_path.exists():
+            file_path.unlink()
+            logger.info(f"Deleted PDF file for document {document_id}")
+        
+        # Clear metadata and status
+        self.docs.pop(document_id, None)
+
+    async def delete_vectors(self, document_id: str) -> bool:
+        """Delete the vector store data of a document"""
+        success = await self.vector_store.delete_document(document_id)
+        if success:
+            logger.info(f"Deleted vector store data for document {document_id}")
+        return success
+
+    def forget_document(self, document_id: str) -> bool:
+        """Delete the file and state of a document, leaving its vectors for delete_vectors"""
+        try:
+            self._delete_file_and_state(document_id)
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting document {document_id}: {str(e)}")
+            return False
+
     async def delete_document(self, document_id: str) -> bool:
         """Delete document files and associated data"""
         try:
-            # Delete PDF file
-            file_path = self.upload_dir / f"{document_id}.pdf"
-            if file_path.exists():
-                file_path.unlink()
-                logger.info(f"Deleted PDF file for document {document_id}")
-            
-            # Delete vector store data
-            await self.vector_store.delete_document(document_id)
-            logger.info(f"Deleted vector store data for document {document_id}")
-            
-            # Clear metadata and status
-            self.document_metadata.pop(document_id, None)
-            self.processing_status.pop(document_id, None)
-            
+            self._delete_file_and_state(document_id)
+            await self.delete_vectors(document_id)
             return True
         except Exception as e:
             logger.error(f"Error deleting document {document_id}: {str(e)}")
             return False
 
-    def _create_chunks_from_text(self, text: str, page_num: int) -> List[DocumentChunk]:
-        chunks = []
-        doc = self.nlp(text)
-        
-        current_chunk = []
-        current_length = 0
-        chunk_id = 0
-        
-        for para in doc.sents:
-            para_text = para.text.strip()
-            if not para_text:
-                continue
-                
-            # If adding this paragraph would exceed chunk size, save current chunk
-            if current_length + len(para_text) > self.chunk_size and current_chunk:
-                chunk_text = " ".join(current_chunk)
-                chunks.append(DocumentChunk(
-                    chunk_id=f"{page_num}-{chunk_id}",
-                    text=chunk_text,
-                    page_number=page_num,
-                    metadata={
-                        "position": chunk_id,
-                        "length": len(chunk_text),
-                        "page": page_num
-                    }
-                ))
-                chunk_id += 1
-                
-                # Keep last paragraph for overlap
-                overlap_size = 0
-                overlap_chunk = []
-                for text in reversed(current_chunk):
-                    if overlap_size + len(text) > self.chunk_overlap:
-                        break
-                    overlap_chunk.insert(0, text)
-                    overlap_size += len(text)
-                
-                current_chunk = overlap_chunk
-                current_length = overlap_size
-            
-            current_chunk.append(para_text)
-            current_length += len(para_text)
-        
-        # Don't forget the last chunk
-        if current_chunk:
-            chunk_text = " ".join(current_chunk)
-            chunks.append(DocumentChunk(
-                chunk_id=f"{page_num}-{chunk_id}",
-                text=chunk_text,
-                page_number=page_num,
-                metadata={
-                    "position": chunk_id,
-                    "length": len(chunk_text),
-                    "page": page_num
-                }
-            ))
-        
-        return chunks
-
-    async def _extract_text(self, file_path: Path) -> List[DocumentChunk]:
-        chunks = []
+    async def _extract_text(self, file_path: Path, total_pages: Optional[int] = None, progress_callback: Optional[Callable[[str, float], None]] = None) -> AsyncIterator[List[StoredChunk]]:
+        """Yield chunk batches in page order as the page workers finish them"""
+        chunk_count = 0
         try:
-            with open(file_path, "rb") as file:
+            if not total_pages:
                 try:
-                    reader = PyPDF2.PdfReader(file)
+                    pdf = pdfium.PdfDocument(str(file_path))
+                    total_pages = len(pdf)
+                    pdf.close()
                 except Exception as e:
                     raise PDFCorruptedError(f"Failed to read PDF file: {str(e)}")
-                
-                total_pages = len(reader.pages)
-                logger.info(f"Processing PDF with {total_pages} pages")
-                
-                for page_num in range(total_pages):
-                    try:
-                        text = reader.pages[page_num].extract_text()
-                        if text.strip():  # Only process non-empty pages
-                            page_chunks = self._create_chunks_from_text(text, page_num)
-                            chunks.extend(page_chunks)
-                            logger.debug(f"Processed page {page_num + 1}/{total_pages} with {len(page_chunks)} chunks")
-                    except Exception as e:
-                        logger.warning(f"Error processing page {page_num}: {str(e)}")
-                        continue
-                        
+            
+            logger.info(f"Processing PDF with {total_pages} pages")
+            
+            # Extract and chunk pages in batches on the process pool. Batches are
+            # submitted lazily so at most MAX_PAGE_BATCHES_IN_FLIGHT are running or
+            # buffered at once; a slow consumer holds extraction back
+            loop = asyncio.get_running_loop()
+            starts = iter(range(0, total_pages, PAGE_BATCH_SIZE))
+            in_flight: Dict[asyncio.Future, Tuple[int, int]] = {}
+            # Batches can finish out of order; hold them until their turn
+            finished = {}
+            next_start = 0
+            pages_done = 0
+            
+            def submit_batches():
+                while len(in_flight) + len(finished) < MAX_PAGE_BATCHES_IN_FLIGHT:
+                    start = next(starts, None)
+                    if start is None:
+                        return
+                    stop = min(start + PAGE_BATCH_SIZE, total_pages)
+                    future = loop.run_in_executor(
+                        _page_executor, _process_pages, str(file_path), start, stop,
+                        self.chunk_size, self.chunk_overlap
+                    )
+                    in_flight[future] = (start, stop)
+            
+            try:
+                submit_batches()
+                while in_flight:
+                    done, _ = await asyncio.wait(set(in_flight), return_when=asyncio.FIRST_COMPLETED)
+                    for future in done:
+                        start, stop = in_flight.pop(future)
+                        finished[start] = (stop, future.result())
+                        pages_done += stop - start
+                    if progress_callback:
+                        await progress_callback(
+                            f"Extracting text ({pages_done}/{total_pages} pages)",
+                            pages_done / total_pages
+                        )
+                    
+                    while next_start in finished:
+                        next_stop, ready_chunks = finished.pop(next_start)
+                        next_start = next_stop
+                        if ready_chunks:
+                            chunk_count += len(ready_chunks)
+                            yield ready_chunks
+                    
+                    submit_batches()
+            finally:
+                # Don't leave queued page batches behind if indexing stopped early
+                for future in in_flight:
+                    future.cancel()
+                    
         except PDFProcessingError:
             raise
         except Exception as e:
             raise PDFExtractionError(f"Error processing PDF: {str(e)}")
             
-        if not chunks:
+        if not chunk_count:
             raise EmptyDocumentError("No text content could be extracted from the PDF")
             
-        logger.info(f"Successfully extracted {len(chunks)} chunks from PDF")
-        return chunks
+        logger.info(f"Successfully extracted {chunk_count} chunks from PDF")
 
     async def get_document_status(self, document_id: str) -> Dict:
         """Get the current status of document processing"""
-        if document_id not in self.processing_status:
+        state = self.docs.get(document_id)
+        if state is None:
             return None
             
         return {
             "document_id": document_id,
-            "status": self.processing_status[document_id],
-            "metadata": self.document_metadata.get(document_id, {})
+            "status": state.status,
+            "metadata": {**state.metadata, "processing_progress": state.progress}
         }
\ No newline at end of file
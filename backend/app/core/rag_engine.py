@@ -1,21 +1,67 @@
 from transformers import AutoTokenizer, T5ForConditionalGeneration
 import torch
-from app.core.vector_store import VectorStore
+from app.core.vector_store import get_vector_store
+from app.core.torch_config import CUDA_AVAILABLE, MODEL_COMPILE, MODEL_DEVICE
 from app.models.query import QueryResponse
-from typing import List, Dict
+from app.models.document import DocumentChunk
+from collections import OrderedDict
+from typing import List, Dict, Tuple
+import hashlib
+import asyncio
+import time
 import os
 import logging
 import gc
 
 logger = logging.getLogger(__name__)
 
+# Generation settings
+NUM_BEAMS = int(os.getenv("NUM_BEAMS", "1"))
+MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "256"))
+
+# Retrieval cache for repeated questions against the same document
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "300"))
+
+PROMPT_TEMPLATE = """
+Given the following context, please answer the question. Use only the information provided in the context.
+If you cannot find the answer in the context, say "I cannot find the answer in the provided context."
+
+Context:
+{context}
+
+Question: {question}
+
+Answer:"""
+
+def _cpu_supports_bf16() -> bool:
+    """Check whether the CPU has native bfloat16 support (AVX-512 BF16 / AMX)"""
+    check = getattr(torch.cpu, "_is_avx512_bf16_supported", None)
+    return bool(check and check())
+
 class RAGEngine:
     def __init__(self):
-        self.vector_store = VectorStore()
+        self.vector_store = get_vector_store()
         self.model_name = "google/flan-t5-base"  # Changed to public model
-        self.device = os.getenv("MODEL_DEVICE", "cpu")
+        self.device = MODEL_DEVICE
         self.max_input_tokens = 4096
-        self._load_model()
+        self._retrieval_cache: "OrderedDict[Tuple[str, int, str], Tuple[float, List[DocumentChunk]]]" = OrderedDict()
+        # Bumped by invalidate() so searches that straddle a delete aren't cached
+        self._generations: Dict[str, int] = {}
+        # The model is loaded on the first query rather than at import
+        self.model = None
+        self.tokenizer = None
+        self._load_lock = None
+
+    async def _ensure_loaded(self):
+        """Load the model off the event loop if it hasn't been loaded yet"""
+        if self.model is not None:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if self.model is None:
+                await asyncio.to_thread(self._load_model)
 
     def _load_model(self):
         """Load model with proper memory management"""
@@ -24,92 +70,155 @@ class RAGEngine:
             
             # Clear any existing tensors
             gc.collect()
-            if torch.cuda.is_available():
+            if CUDA_AVAILABLE:
                 torch.cuda.empty_cache()
             
+            if self.device == "cuda":
+                self.torch_dtype = torch.float16
+            elif _cpu_supports_bf16():
+                self.torch_dtype = torch.bfloat16
+            else:
+                self.torch_dtype = torch.float32
+            
             self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self._prepare_prompt_ids()
             self.model = T5ForConditionalGeneration.from_pretrained(
                 self.model_name,
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
+                torch_dtype=self.torch_dtype,
                 device_map="auto" if self.device == "cuda" else None,
                 low_cpu_mem_usage=True
             )
             
             if self.device == "cpu":
                 self.model = self.model.to("cpu")
+            
+            self.model.eval()
+            if MODEL_COMPILE and hasattr(torch, "compile"):
+                # generate() calls forward() per decoding step, so compile that
+                self.model.forward = torch.compile(self.model.forward, mode="reduce-overhead")
                 
-            logger.info("Model loaded successfully")
+            logger.info(f"Model loaded successfully ({self.torch_dtype})")
             
         except Exception as e:
             logger.error(f"Error loading model: {str(e)}")
             raise
 
+    def _prepare_prompt_ids(self):
+        """Pre-tokenize the static parts of the prompt template"""
+        prefix, rest = PROMPT_TEMPLATE.split("{context}")
+        middle, suffix = rest.split("{question}")
+        encode = lambda text: self.tokenizer(text, add_special_tokens=False).input_ids
+        self._prefix_ids = encode(prefix)
+        self._middle_ids = encode(middle)
+        self._suffix_ids = encode(suffix)
+        self._separator_ids = encode("\n")
+        # Constant cost of the template around context and question, plus EOS
+        self._template_token_overhead = (
+            len(self._prefix_ids) + len(self._middle_ids) + len(self._suffix_ids) + 1
+        )
+
+    async def _retrieve(self, document_id: str, question: str, k: int) -> List[DocumentChunk]:
+        """Search the vector store, reusing recent results for repeated questions"""
+        key = (document_id, k, hashlib.blake2b(question.encode(), digest_size=16).hexdigest())
+        now = time.monotonic()
+        
+        cached = self._retrieval_cache.get(key)
+        if cached and now - cached[0] < RETRIEVAL_CACHE_TTL:
+            self._retrieval_cache.move_to_end(key)
+            return cached[1]
+        
+        generation = self._generations.get(document_id, 0)
+        chunks = await self.vector_store.search(document_id, question, k=k)
+        if self._generations.get(document_id, 0) != generation:
+            # Invalidated mid-search; the result may come from a deleted index
+            return chunks
+        self._retrieval_cache[key] = (now, chunks)
+        self._retrieval_cache.move_to_end(key)
+        while len(self._retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+            self._retrieval_cache.popitem(last=False)
+        return chunks
+
+    def invalidate(self, document_id: str):
+        """Drop cached retrieval results for a document"""
+        self._generations[document_id] = self._generations.get(document_id, 0) + 1
+        for key in [key for key in self._retrieval_cache if key[0] == document_id]:
+            del self._retrieval_cache[key]
+
     async def process_query(self, question: str, document_id: str, context_window: int = 4096) -> QueryResponse:
         try:
+            await self._ensure_loaded()
+            
             # Update max input tokens based on context window
             self.max_input_tokens = min(context_window, 4096)  # Cap at model's limit
             
             # Retrieve relevant chunks
-            relevant_chunks = await self.vector_store.search(document_id, question, k=5)  # Get more chunks initially
+            relevant_chunks = await self._retrieve(document_id, question, k=5)  # Get more chunks initially
             
-            # Prepare context within token limit
-            context_texts = []
-            total_tokens = 0
-            prompt_template = """
-Given the following context, please answer the question. Use only the information provided in the context.
-If you cannot find the answer in the context, say "I cannot find the answer in the provided context."
-
-Context:
-{context}
-
-Question: {question}
-
-Answer:"""
+            # Tokenize the question and all candidate chunks in one batch
+            encoded = self.tokenizer(
+                [question] + [chunk.text for chunk in relevant_chunks],
+                add_special_tokens=False
+            ).input_ids
+            question_ids = encoded[0]
             
-            # Calculate tokens for prompt template
-            template_tokens = len(self.tokenizer.encode(prompt_template.format(context="", question=question)))
-            available_tokens = self.max_input_tokens - template_tokens - 100  # Reserve tokens for the answer
+            available_tokens = (
+                self.max_input_tokens - self._template_token_overhead - len(question_ids)
+                - 100  # Reserve tokens for the answer
+            )
             
-            # Add chunks while respecting token limit
-            for chunk in relevant_chunks:
-                chunk_tokens = len(self.tokenizer.encode(chunk.text))
+            # Pack chunk token ids while respecting token limit
+            context_texts = []
+            context_ids = []
+            total_tokens = 0
+            for chunk, chunk_ids in zip(relevant_chunks, encoded[1:]):
+                chunk_tokens = len(chunk_ids) + (len(self._separator_ids) if context_ids else 0)
                 if total_tokens + chunk_tokens > available_tokens:
                     break
+                if context_ids:
+                    context_ids.extend(self._separator_ids)
+                context_ids.extend(chunk_ids)
                 context_texts.append(chunk.text)
                 total_tokens += chunk_tokens
             
-            context = "\n".join(context_texts)
-            
-            # Create prompt
-            prompt = prompt_template.format(context=context, question=question)
+            # Assemble the prompt directly in token id space
+            input_ids = (
+                self._prefix_ids + context_ids + self._middle_ids + question_ids
+                + self._suffix_ids + [self.tokenizer.eos_token_id]
+            )
 
             try:
                 # Generate response
-                # T5 expects a more straightforward input format
-                inputs = self.tokenizer(prompt, return_tensors="pt", truncation=True, max_length=self.max_input_tokens).to(self.device)
+                input_tensor = torch.tensor([input_ids], device=self.device)
+                inputs = {
+                    "input_ids": input_tensor,
+                    "attention_mask": torch.ones_like(input_tensor)
+                }
                 
-                with torch.inference_mode():
+                with torch.inference_mode(), torch.autocast(
+                    device_type=self.device,
+                    dtype=self.torch_dtype,
+                    enabled=self.torch_dtype != torch.float32
+                ):
                     outputs = self.model.generate(
                         **inputs,
-                        max_length=512,  # T5 doesn't need the input length added here
-                        temperature=0.7,
-                        top_p=0.95,
-                        do_sample=True,
-                        num_beams=4,  # Adding beam search for better quality
-                        early_stopping=True
+                        max_new_tokens=MAX_NEW_TOKENS,
+                        do_sample=False,
+                        num_beams=NUM_BEAMS,  # Greedy by default; raise for quality at the cost of latency
+                        use_cache=True,
+                        early_stopping=NUM_BEAMS > 1
                     )
                 
                 answer = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
                 
                 # Clean up GPU memory if using CUDA
-                if self.device == "cuda":
+                if CUDA_AVAILABLE and self.device == "cuda":
                     del inputs, outputs
                     torch.cuda.empty_cache()
                 
             except RuntimeError as e:
                 if "out of memory" in str(e):
                     # If we run out of memory, try to recover
-                    if self.device == "cuda":
+                    if CUDA_AVAILABLE and self.device == "cuda":
                         torch.cuda.empty_cache()
                         gc.collect()
                     self._load_model()  # Reload model
@@ -125,7 +234,7 @@ Answer:"""
                 for chunk in relevant_chunks[:len(context_texts)]
             ) / len(context_texts) if context_texts else 0
             
-            confidence = min(1.0, (len(context_texts) / 5) * (1 - avg_similarity/2))
+            confidence = min(1.0, (len(context_texts) / 5) * avg_similarity)
             
             return QueryResponse(
                 query=question,
@@ -148,7 +257,7 @@ Answer:"""
         except Exception as e:
             logger.error(f"Error processing query: {str(e)}")
             # Ensure memory is cleaned up on error
-            if self.device == "cuda":
+            if CUDA_AVAILABLE and self.device == "cuda":
                 torch.cuda.empty_cache()
             gc.collect()
             raise
\ No newline at end of file
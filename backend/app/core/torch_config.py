@@ -0,0 +1,13 @@
+import os
+import torch
+
+# CUDA availability doesn't change at runtime; query it once for the whole app
+CUDA_AVAILABLE = torch.cuda.is_available()
+
+# MODEL_DEVICE is documented as "cpu"/"gpu"; torch only understands "cuda"
+MODEL_DEVICE = (
+    "cuda" if os.getenv("MODEL_DEVICE", "cpu") in ("gpu", "cuda") and CUDA_AVAILABLE else "cpu"
+)
+
+# Compile model forward passes with torch.compile (opt-in, pays a warm-up cost at load)
+MODEL_COMPILE = os.getenv("MODEL_COMPILE", "0") == "1"
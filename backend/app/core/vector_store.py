@@ -1,91 +1,253 @@
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Optional, Callable
-import pickle
+from typing import List, Dict, Optional, Callable, AsyncIterator, Tuple
+from collections import OrderedDict
+import json
+import hashlib
+import pyarrow as pa
+import pyarrow.feather as feather
 from pathlib import Path
 import logging
-from app.models.document import DocumentChunk
+from app.models.document import DocumentChunk, StoredChunk
+from app.core.onnx_encoder import OnnxEncoder
+from app.core.torch_config import MODEL_COMPILE, MODEL_DEVICE
 import asyncio
+import os
+import torch
 from concurrent.futures import ThreadPoolExecutor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# "sentence-transformers" (PyTorch) or "onnx" (int8-quantized ONNX Runtime, CPU)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+ONNX_MODEL_DIR = Path(os.getenv("ONNX_MODEL_DIR", "onnx_model"))
+
+# Encoding is compute-bound; larger batches help until the device saturates
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "128" if MODEL_DEVICE == "cuda" else "64"))
+
+# Max encoder batches per encode call during streaming ingestion; encode() length-sorts
+# its whole input, so a wider window pads less but holds the encoder thread longer
+ENCODE_WINDOW_BATCHES = int(os.getenv("ENCODE_WINDOW_BATCHES", "2"))
+
+# Number of loaded indexes kept in memory for search
+INDEX_CACHE_SIZE = int(os.getenv("INDEX_CACHE_SIZE", "32"))
+
+def _chunks_to_table(chunks: List[StoredChunk], duplicates: Optional[Dict[int, List[str]]] = None) -> pa.Table:
+    """Lay chunks out as columns for the on-disk Arrow file"""
+    duplicates = duplicates or {}
+    return pa.table({
+        "chunk_id": pa.array([chunk.chunk_id for chunk in chunks], pa.string()),
+        "text": pa.array([chunk.text for chunk in chunks], pa.string()),
+        "page_number": pa.array([chunk.page_number for chunk in chunks], pa.int32()),
+        "metadata": pa.array([json.dumps(chunk.metadata) for chunk in chunks], pa.string()),
+        # Ids of chunks with the same text that were folded into this row
+        "duplicate_chunk_ids": pa.array(
+            [duplicates.get(row, []) for row in range(len(chunks))], pa.list_(pa.string())
+        ),
+    })
+
+class _ChunkDeduplicator:
+    """Collapse chunks with identical text so each distinct text is encoded and indexed once"""
+    def __init__(self):
+        self._rows: Dict[bytes, int] = {}
+        self.unique: List[StoredChunk] = []
+        # Row of a unique chunk -> ids of the duplicates mapped onto it
+        self.duplicates: Dict[int, List[str]] = {}
+    
+    def add(self, chunks: List[StoredChunk]) -> List[StoredChunk]:
+        """Record chunks and return the ones whose text was not seen before"""
+        new_chunks = []
+        for chunk in chunks:
+            key = hashlib.blake2b(chunk.text.encode(), digest_size=16).digest()
+            row = self._rows.get(key)
+            if row is None:
+                self._rows[key] = len(self.unique)
+                self.unique.append(chunk)
+                new_chunks.append(chunk)
+            else:
+                self.duplicates.setdefault(row, []).append(chunk.chunk_id)
+        return new_chunks
+
+_MODEL = None
+
+def _get_model():
+    """Load the embedding model once per process"""
+    global _MODEL
+    if _MODEL is None:
+        if EMBEDDING_BACKEND == "onnx":
+            _MODEL = OnnxEncoder(EMBEDDING_MODEL, ONNX_MODEL_DIR)
+        else:
+            model = SentenceTransformer(EMBEDDING_MODEL, device=MODEL_DEVICE)
+            if MODEL_DEVICE == "cuda":
+                # fp16 matmuls run on tensor cores
+                model = model.half()
+            model.eval()
+            if MODEL_COMPILE and hasattr(torch, "compile"):
+                # sentence-transformers calls auto_model(**features), so compiling
+                # the inner transformer fuses attention/LayerNorm/GELU kernels
+                transformer = model._first_module()
+                transformer.auto_model = torch.compile(
+                    transformer.auto_model, mode="reduce-overhead", dynamic=True
+                )
+                # Pay the compilation cost at startup rather than on the first upload
+                with torch.inference_mode():
+                    model.encode(["warm up"], show_progress_bar=False)
+            _MODEL = model
+    return _MODEL
+
 class VectorStore:
     def __init__(self):
-        self.model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+        self.model = _get_model()
         self.index_dir = Path("vector_indices")
         self.index_dir.mkdir(exist_ok=True)
         self.dimension = 384  # Model embedding dimension
+        # HNSW graph parameters: neighbours per node, build and search beam widths
+        self.hnsw_M = 32
+        self.ef_construction = 200
+        self.ef_search = 64
+        self.encode_batch_size = ENCODE_BATCH_SIZE
         self._executor = ThreadPoolExecutor(max_workers=1)
+        # Separate thread for index builds so query encoding never waits behind one
+        self._index_executor = ThreadPoolExecutor(max_workers=1)
+        # Recently searched documents, most recently used last
+        self._index_cache: "OrderedDict[str, Tuple[faiss.Index, pa.Table]]" = OrderedDict()
         
-    async def add_chunks(self, document_id: str, chunks: List[DocumentChunk], progress_callback: Optional[Callable[[str, float], None]] = None) -> None:
-        if not chunks:
-            raise ValueError("No chunks provided for indexing")
-            
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts to embeddings; runs on the executor thread"""
+        with torch.inference_mode():
+            return self.model.encode(
+                texts,
+                batch_size=self.encode_batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True
+            )
+        
+    async def add_chunks_stream(self, document_id: str, chunk_batches: AsyncIterator[List[StoredChunk]], window_size: Optional[int] = None, progress_callback: Optional[Callable[[str, float], None]] = None) -> List[StoredChunk]:
+        """Index chunks as they are produced, encoding while extraction continues"""
+        # Bounded queue lets extraction run a few batches ahead; _extract_text also
+        # caps the page batches it has in flight, so memory stays bounded end to end
+        queue: asyncio.Queue = asyncio.Queue(maxsize=4)
+        done = object()
+        window_size = window_size or self.encode_batch_size * ENCODE_WINDOW_BATCHES
+        
+        async def produce():
+            try:
+                async for batch in chunk_batches:
+                    await queue.put(batch)
+            except Exception:
+                await queue.put(done)
+                raise
+            await queue.put(done)
+        
+        producer = asyncio.create_task(produce())
         try:
-            # Update progress
-            if progress_callback:
-                await progress_callback("Preparing chunks for indexing...", 0.1)
-                
-            texts = [chunk.text for chunk in chunks]
-            total_chunks = len(texts)
-            
-            # Encode chunks in batches to show progress
-            batch_size = 32
+            chunks = []
             all_embeddings = []
+            pending = []
+            encoded = 0
+            # Only chunks with unseen text are queued for encoding
+            dedup = _ChunkDeduplicator()
+            loop = asyncio.get_running_loop()
+            while True:
+                item = await queue.get()
+                if item is not done:
+                    chunks.extend(item)
+                    pending.extend(dedup.add(item))
+                # Encode up to a window per call so the encoder's length sort groups
+                # similar-length chunks across batches; rows come back in order. Don't
+                # wait for a full window while extraction has nothing else ready
+                while pending and (len(pending) >= window_size or item is done or queue.empty()):
+                    window, pending = pending[:window_size], pending[window_size:]
+                    texts = [chunk.text for chunk in window]
+                    embeddings = await loop.run_in_executor(self._executor, self._encode, texts)
+                    all_embeddings.append(embeddings)
+                    encoded += len(window)
+                    if progress_callback:
+                        # Encoding owns 0-70%; the total grows while extraction runs
+                        total = len(dedup.unique)
+                        await progress_callback(f"Encoding chunks ({encoded}/{total})...", 0.7 * encoded / total)
+                if item is done:
+                    break
             
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
-                # Run encoding in thread pool to avoid blocking
-                loop = asyncio.get_event_loop()
-                embeddings = await loop.run_in_executor(
-                    self._executor,
-                    lambda: self.model.encode(batch, show_progress_bar=False)
-                )
-                all_embeddings.append(embeddings)
-                
-                if progress_callback:
-                    progress = 0.1 + 0.6 * (min(i + batch_size, total_chunks) / total_chunks)
-                    await progress_callback(
-                        f"Encoding chunks ({min(i + batch_size, total_chunks)}/{total_chunks})...",
-                        progress
-                    )
-            
-            embeddings = np.vstack(all_embeddings)
+            # Surface any extraction error
+            await producer
             
-            if len(embeddings) != len(chunks):
-                raise ValueError(f"Mismatch between embeddings ({len(embeddings)}) and chunks ({len(chunks)})")
+            if not chunks:
+                raise ValueError("No chunks provided for indexing")
             
-            if progress_callback:
-                await progress_callback("Creating FAISS index...", 0.8)
-            
-            # Create FAISS index
-            index = faiss.IndexFlatL2(self.dimension)
-            index.add(np.array(embeddings).astype('float32'))
+            embeddings = np.vstack(all_embeddings)
+            await self._save_index(document_id, dedup.unique, embeddings, progress_callback, dedup.duplicates)
+            return chunks
             
-            if progress_callback:
-                await progress_callback("Saving index and metadata...", 0.9)
+        except Exception as e:
+            producer.cancel()
+            logger.error(f"Error indexing chunks for document {document_id}: {str(e)}")
+            raise
+    
+    async def _save_index(self, document_id: str, chunks: List[StoredChunk], embeddings: np.ndarray, progress_callback: Optional[Callable[[str, float], None]] = None, duplicates: Optional[Dict[int, List[str]]] = None) -> None:
+        """Build the FAISS index for encoded chunks and persist it with the chunks"""
+        if len(embeddings) != len(chunks):
+            raise ValueError(f"Mismatch between embeddings ({len(embeddings)}) and chunks ({len(chunks)})")
+        
+        if progress_callback:
+            await progress_callback("Creating FAISS index...", 0.8)
+        
+        # HNSW construction and file writes are CPU/IO heavy; keep them off the event loop
+        loop = asyncio.get_running_loop()
+        index = await loop.run_in_executor(self._index_executor, self._build_index, embeddings)
+        
+        if progress_callback:
+            await progress_callback("Saving index and metadata...", 0.9)
+        
+        await loop.run_in_executor(self._index_executor, self._write_index_files, document_id, index, chunks, duplicates)
+        self._index_cache.pop(document_id, None)
             
-            # Save index and metadata
-            index_path = self.index_dir / f"{document_id}.index"
-            chunks_path = self.index_dir / f"{document_id}.pkl"
+        if progress_callback:
+            await progress_callback("Indexing completed", 1.0)
             
-            faiss.write_index(index, str(index_path))
-            with open(chunks_path, 'wb') as f:
-                pickle.dump(chunks, f)
-                
-            if progress_callback:
-                await progress_callback("Indexing completed", 1.0)
-                
-            logger.info(f"Successfully indexed {len(chunks)} chunks for document {document_id}")
+        duplicate_count = sum(len(ids) for ids in (duplicates or {}).values())
+        logger.info(f"Successfully indexed {len(chunks)} chunks for document {document_id} ({duplicate_count} duplicates folded)")
+    
+    def _build_index(self, embeddings: np.ndarray) -> faiss.Index:
+        """Build the HNSW index over normalized embeddings; runs on the executor thread"""
+        # Normalize once so inner product is cosine similarity
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+        
+        # Create FAISS HNSW index over fp16-quantized vectors
+        index = faiss.IndexHNSWSQ(
+            self.dimension, faiss.ScalarQuantizer.QT_fp16, self.hnsw_M, faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = self.ef_construction
+        index.train(embeddings)
+        index.add(embeddings)
+        return index
+    
+    def _write_index_files(self, document_id: str, index: faiss.Index, chunks: List[StoredChunk], duplicates: Optional[Dict[int, List[str]]] = None) -> None:
+        """Persist the index and chunks; runs on the executor thread"""
+        # Save index and metadata to temporary files, then rename them into place
+        # so readers never see a partially written file
+        index_path = self.index_dir / f"{document_id}.index"
+        chunks_path = self.index_dir / f"{document_id}.arrow"
+        tmp_index_path = index_path.with_suffix(".index.tmp")
+        tmp_chunks_path = chunks_path.with_suffix(".arrow.tmp")
+        
+        try:
+            faiss.write_index(index, str(tmp_index_path))
+            # Uncompressed so search can memory-map the file and read only the hits
+            feather.write_feather(_chunks_to_table(chunks, duplicates), str(tmp_chunks_path), compression="uncompressed")
             
-        except Exception as e:
-            logger.error(f"Error indexing chunks for document {document_id}: {str(e)}")
-            # Clean up any partially created files
-            self._cleanup_index_files(document_id)
+            # Chunks first: _load_index only opens a document once its index exists
+            os.replace(tmp_chunks_path, chunks_path)
+            os.replace(tmp_index_path, index_path)
+        except Exception:
+            tmp_index_path.unlink(missing_ok=True)
+            tmp_chunks_path.unlink(missing_ok=True)
             raise
+        self._fsync_index_dir()
             
     async def search(self, document_id: str, query: str, k: int = 3) -> List[DocumentChunk]:
         try:
@@ -95,35 +257,38 @@ class VectorStore:
             if k < 1:
                 raise ValueError("k must be positive")
                 
-            index_path = self.index_dir / f"{document_id}.index"
-            chunks_path = self.index_dir / f"{document_id}.pkl"
-            
-            if not index_path.exists() or not chunks_path.exists():
-                raise FileNotFoundError(f"No index found for document {document_id}")
-            
-            # Load index and metadata
-            index = faiss.read_index(str(index_path))
-            with open(chunks_path, 'rb') as f:
-                chunks = pickle.load(f)
+            index, table = self._load_index(document_id)
             
             # Run query encoding in thread pool
-            loop = asyncio.get_event_loop()
-            query_vector = await loop.run_in_executor(
-                self._executor,
-                lambda: self.model.encode([query])
-            )
+            loop = asyncio.get_running_loop()
+            query_vector = await loop.run_in_executor(self._executor, self._encode, [query])
             
             # Search similar vectors
-            D, I = index.search(np.array(query_vector).astype('float32'), min(k, len(chunks)))
+            query_vector = np.ascontiguousarray(query_vector, dtype=np.float32)
+            faiss.normalize_L2(query_vector)
+            D, I = index.search(query_vector, min(k, table.num_rows))
+            
+            # Materialize only the hit rows, sorted by similarity
+            hits = [
+                (float(score), int(idx)) for score, idx in zip(D[0], I[0])
+                if 0 <= idx < table.num_rows  # Safety check; HNSW pads missing hits with -1
+            ]
+            rows = table.take(pa.array([idx for _, idx in hits], pa.int64())).to_pylist()
             
-            # Return relevant chunks sorted by similarity
             results = []
-            for score, idx in zip(D[0], I[0]):
-                if idx < len(chunks):  # Safety check
-                    chunk = chunks[idx]
-                    # Add similarity score to metadata
-                    chunk.metadata['similarity_score'] = float(score)
-                    results.append(chunk)
+            for (score, _), row in zip(hits, rows):
+                metadata = json.loads(row["metadata"])
+                # Add similarity score to metadata
+                metadata['similarity_score'] = score
+                # Indexes written before deduplication have no such column
+                if row.get("duplicate_chunk_ids"):
+                    metadata['duplicate_chunk_ids'] = row["duplicate_chunk_ids"]
+                results.append(DocumentChunk(
+                    chunk_id=row["chunk_id"],
+                    text=row["text"],
+                    page_number=row["page_number"],
+                    metadata=metadata
+                ))
                     
             return results
             
@@ -131,11 +296,50 @@ class VectorStore:
             logger.error(f"Error searching document {document_id}: {str(e)}")
             raise
             
+    def _load_index(self, document_id: str) -> Tuple[faiss.Index, pa.Table]:
+        """Return the index and chunks of a document, loading them on a cache miss"""
+        cached = self._index_cache.get(document_id)
+        if cached is not None:
+            self._index_cache.move_to_end(document_id)
+            return cached
+        
+        index_path = self.index_dir / f"{document_id}.index"
+        chunks_path = self.index_dir / f"{document_id}.arrow"
+        
+        if not index_path.exists() or not chunks_path.exists():
+            raise FileNotFoundError(f"No index found for document {document_id}")
+        
+        # Load index and metadata, memory-mapping the index where FAISS supports it
+        try:
+            index = faiss.read_index(str(index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            index = faiss.read_index(str(index_path))
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = self.ef_search
+        # Zero-copy read; rows are only decoded when search takes them
+        table = pa.ipc.open_file(pa.memory_map(str(chunks_path))).read_all()
+        
+        self._index_cache[document_id] = (index, table)
+        if len(self._index_cache) > INDEX_CACHE_SIZE:
+            self._index_cache.popitem(last=False)
+        return index, table
+    
+    def _fsync_index_dir(self) -> None:
+        """Persist the renames of freshly written index files"""
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        dir_fd = os.open(self.index_dir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    
     def _cleanup_index_files(self, document_id: str) -> None:
-        """Clean up index files in case of errors"""
+        """Remove the index files of a document"""
+        self._index_cache.pop(document_id, None)
         try:
             index_path = self.index_dir / f"{document_id}.index"
-            chunks_path = self.index_dir / f"{document_id}.pkl"
+            chunks_path = self.index_dir / f"{document_id}.arrow"
             
             if index_path.exists():
                 index_path.unlink()
@@ -151,4 +355,13 @@ class VectorStore:
             return True
         except Exception as e:
             logger.error(f"Error deleting document {document_id}: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+
+_vector_store: Optional[VectorStore] = None
+
+def get_vector_store() -> VectorStore:
+    """Return the process-wide vector store shared by ingestion and querying"""
+    global _vector_store
+    if _vector_store is None:
+        _vector_store = VectorStore()
+    return _vector_store
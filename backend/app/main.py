@@ -1,11 +1,13 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
 from app.api.router import api_router
 import logging
 import os
+import asyncio
 import psutil
 import torch
+import faiss
 import gc
 from app.utils.error_handling import (
     APIError,
@@ -16,8 +18,8 @@ from app.utils.error_handling import (
     general_exception_handler
 )
 from app.utils.security import SecurityMiddleware, APIKeyMiddleware
-from app.utils.rate_limit import rate_limit_middleware
 from app.utils.monitoring import system_monitor
+from app.core.torch_config import CUDA_AVAILABLE
 
 # Configure logging
 logging.basicConfig(
@@ -29,14 +31,19 @@ logging.basicConfig(
 MODEL_DEVICE = os.getenv("MODEL_DEVICE", "cpu")
 TORCH_THREADS = int(os.getenv("TORCH_THREADS", "4"))
 MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", "10485760"))  # 10MB default
+GC_INTERVAL = int(os.getenv("GC_INTERVAL", "300"))  # seconds between background memory cleanups
 
-# Configure torch threads
+CPU_COUNT = psutil.cpu_count()
+
+# Configure torch and FAISS threads; FAISS's OpenMP pool otherwise uses every core
 torch.set_num_threads(TORCH_THREADS)
+faiss.omp_set_num_threads(TORCH_THREADS)
 
 app = FastAPI(
     title="PDF-RAG API",
     description="API for PDF document processing and question answering",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add security middleware first
@@ -63,38 +70,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Add rate limiting middleware
-app.middleware("http")(rate_limit_middleware)
-
-@app.middleware("http")
-async def monitor_requests(request: Request, call_next):
-    metrics = system_monitor.start_request(
-        path=request.url.path,
-        method=request.method
-    )
-    
-    try:
-        response = await call_next(request)
-        system_monitor.end_request(metrics, status_code=response.status_code)
-        return response
-    except Exception as e:
-        system_monitor.end_request(metrics, status_code=500, error=str(e))
-        raise
-
 def get_memory_usage():
     """Get current memory usage statistics"""
-    process = psutil.Process(os.getpid())
-    memory_info = process.memory_info()
+    cached = system_monitor.cached_stats
     
     stats = {
-        "rss": memory_info.rss / (1024 * 1024),  # RSS in MB
-        "vms": memory_info.vms / (1024 * 1024),  # VMS in MB
-        "percent": process.memory_percent(),
-        "cpu_percent": process.cpu_percent(),
+        "rss": cached["proc_rss"] / (1024 * 1024),  # RSS in MB
+        "vms": cached["proc_vms"] / (1024 * 1024),  # VMS in MB
+        "percent": cached["proc_mem_percent"],
+        "cpu_percent": cached["proc_cpu"],
     }
     
     # Add GPU stats if available
-    if torch.cuda.is_available():
+    if CUDA_AVAILABLE:
         stats.update({
             "gpu_memory_allocated": torch.cuda.memory_allocated() / (1024 * 1024),  # MB
             "gpu_memory_reserved": torch.cuda.memory_reserved() / (1024 * 1024),  # MB
@@ -103,28 +91,28 @@ def get_memory_usage():
         
     return stats
 
-@app.middleware("http")
-async def check_file_size(request: Request, call_next):
-    if request.url.path == "/api/documents/upload":
-        try:
-            content_length = int(request.headers.get("content-length", "0"))
-            if content_length > MAX_UPLOAD_SIZE:
-                return JSONResponse(
-                    status_code=413,
-                    content={
-                        "detail": f"File too large. Maximum size allowed is {MAX_UPLOAD_SIZE/1024/1024:.1f}MB"
-                    }
-                )
-        except ValueError:
-            pass
-    return await call_next(request)
+async def _gc_loop():
+    """Periodically run garbage collection and release cached GPU memory"""
+    while True:
+        await asyncio.sleep(GC_INTERVAL)
+        gc.collect()
+        if CUDA_AVAILABLE:
+            torch.cuda.empty_cache()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # Keep references so the tasks are not garbage collected
+    app.state.gc_task = asyncio.create_task(_gc_loop())
+    app.state.sampler_task = asyncio.create_task(system_monitor.run_sampler())
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    app.state.gc_task.cancel()
+    app.state.sampler_task.cancel()
 
 @app.get("/api/health")
 async def health_check():
-    # Run garbage collection
-    gc.collect()
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
+    cached = system_monitor.cached_stats
     
     return {
         "status": "healthy",
@@ -135,13 +123,13 @@ async def health_check():
         },
         "memory": get_memory_usage(),
         "system": {
-            "cpu_count": psutil.cpu_count(),
-            "cpu_freq": psutil.cpu_freq()._asdict() if psutil.cpu_freq() else None,
-            "memory_total": psutil.virtual_memory().total / (1024 * 1024),  # MB
-            "memory_available": psutil.virtual_memory().available / (1024 * 1024),  # MB
-            "gpu_available": torch.cuda.is_available(),
-            "gpu_count": torch.cuda.device_count() if torch.cuda.is_available() else 0,
-            "gpu_name": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None
+            "cpu_count": CPU_COUNT,
+            "cpu_freq": cached["cpu_freq"],
+            "memory_total": cached["mem"]["total"] / (1024 * 1024),  # MB
+            "memory_available": cached["mem"]["available"] / (1024 * 1024),  # MB
+            "gpu_available": CUDA_AVAILABLE,
+            "gpu_count": torch.cuda.device_count() if CUDA_AVAILABLE else 0,
+            "gpu_name": torch.cuda.get_device_name(0) if CUDA_AVAILABLE else None
         }
     }
 
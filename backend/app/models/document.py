@@ -1,6 +1,17 @@
 from pydantic import BaseModel, Field, validator, ConfigDict
 from typing import Optional, Dict, Any
 from datetime import datetime
+from dataclasses import dataclass
+
+@dataclass
+class StoredChunk:
+    """Unvalidated chunk used inside the ingestion pipeline"""
+    __slots__ = ("chunk_id", "text", "page_number", "metadata")
+    
+    chunk_id: str
+    text: str
+    page_number: int
+    metadata: Dict[str, Any]
 
 class DocumentChunk(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True)
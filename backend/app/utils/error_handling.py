@@ -1,5 +1,5 @@
 from fastapi import Request, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from typing import Union, Dict, Any
 import logging
 from app.core.pdf_processor import PDFProcessingError, PDFCorruptedError, EmptyDocumentError
@@ -49,7 +49,7 @@ async def api_error_handler(request: Request, exc: APIError):
         }
     )
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content=error_response
     )
@@ -74,7 +74,7 @@ async def pdf_processing_error_handler(request: Request, exc: PDFProcessingError
         }
     )
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status_code,
         content={
             "error": message,
@@ -92,7 +92,7 @@ async def validation_exception_handler(request: Request, exc: Exception):
         }
     )
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
         content={
             "error": "Validation error",
@@ -111,7 +111,7 @@ async def general_exception_handler(request: Request, exc: Exception):
         }
     )
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content={
             "error": "Internal server error",
@@ -1,9 +1,12 @@
+import asyncio
 import time
 from collections import deque
 from dataclasses import dataclass
 from typing import Deque, Dict, Optional
+import numpy as np
 import psutil
 import torch
+from app.core.torch_config import CUDA_AVAILABLE
 
 @dataclass
 class RequestMetrics:
@@ -18,6 +21,38 @@ class SystemMonitor:
     def __init__(self, max_history: int = 1000):
         self.request_history: Deque[RequestMetrics] = deque(maxlen=max_history)
         self.start_time = time.time()
+        # Ring buffer of (start_time, end_time, status_code) for finished requests
+        self._timings = np.zeros((max_history, 3), dtype=np.float64)
+        self._timings_len = 0
+        self._timings_head = 0
+        # psutil samples refreshed by run_sampler(); readers never hit /proc directly
+        self._process = psutil.Process()
+        self._cached: Dict = {}
+        self.sample()
+    
+    def sample(self):
+        """Refresh the cached system and process statistics"""
+        memory_info = self._process.memory_info()
+        cpu_freq = psutil.cpu_freq()
+        self._cached = {
+            "cpu": psutil.cpu_percent(),
+            "cpu_freq": cpu_freq._asdict() if cpu_freq else None,
+            "mem": psutil.virtual_memory()._asdict(),
+            "proc_rss": memory_info.rss,
+            "proc_vms": memory_info.vms,
+            "proc_mem_percent": self._process.memory_percent(),
+            "proc_cpu": self._process.cpu_percent(),
+        }
+    
+    async def run_sampler(self, interval: float = 1.0):
+        """Resample system statistics every `interval` seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            self.sample()
+    
+    @property
+    def cached_stats(self) -> Dict:
+        return self._cached
     
     def start_request(self, path: str, method: str) -> RequestMetrics:
         metrics = RequestMetrics(
@@ -32,27 +67,26 @@ class SystemMonitor:
         metrics.end_time = time.time()
         metrics.status_code = status_code
         metrics.error = error
+        
+        self._timings[self._timings_head] = (metrics.start_time, metrics.end_time, status_code)
+        self._timings_head = (self._timings_head + 1) % len(self._timings)
+        self._timings_len = min(self._timings_len + 1, len(self._timings))
     
     def get_metrics(self) -> Dict:
         now = time.time()
-        recent_requests = [r for r in self.request_history if r.end_time and now - r.end_time < 60]
+        starts, ends, statuses = self._timings[:self._timings_len].T
+        recent = ends > now - 60
         
         # Calculate request statistics
-        total_requests = len(recent_requests)
-        successful_requests = len([r for r in recent_requests if r.status_code and r.status_code < 400])
-        failed_requests = len([r for r in recent_requests if r.status_code and r.status_code >= 400])
+        total_requests = int(np.count_nonzero(recent))
+        successful_requests = int(np.count_nonzero(statuses[recent] < 400))
+        failed_requests = total_requests - successful_requests
         
         # Calculate average response time
-        response_times = [
-            r.end_time - r.start_time 
-            for r in recent_requests 
-            if r.end_time is not None
-        ]
-        avg_response_time = sum(response_times) / len(response_times) if response_times else 0
+        avg_response_time = float((ends[recent] - starts[recent]).mean()) if total_requests else 0
         
-        # System metrics
-        process = psutil.Process()
-        memory_info = process.memory_info()
+        # System metrics, as last sampled
+        cached = self._cached
         
         metrics = {
             "uptime_seconds": now - self.start_time,
@@ -63,14 +97,14 @@ class SystemMonitor:
                 "average_response_time": avg_response_time
             },
             "system": {
-                "cpu_percent": psutil.cpu_percent(),
-                "memory_percent": psutil.virtual_memory().percent,
-                "process_memory_mb": memory_info.rss / (1024 * 1024),
+                "cpu_percent": cached["cpu"],
+                "memory_percent": cached["mem"]["percent"],
+                "process_memory_mb": cached["proc_rss"] / (1024 * 1024),
             }
         }
         
         # Add GPU metrics if available
-        if torch.cuda.is_available():
+        if CUDA_AVAILABLE:
             metrics["system"].update({
                 "gpu_memory_allocated_mb": torch.cuda.memory_allocated() / (1024 * 1024),
                 "gpu_memory_cached_mb": torch.cuda.memory_reserved() / (1024 * 1024),
@@ -0,0 +1,28 @@
+import time
+from typing import Awaitable, Callable
+
+class ProgressThrottle:
+    """Forward progress updates at most every `min_interval` seconds or `min_delta` progress"""
+    def __init__(
+        self,
+        callback: Callable[[str, float], Awaitable[None]],
+        min_interval: float = 0.1,
+        min_delta: float = 0.05
+    ):
+        self.callback = callback
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self._last_progress = float("-inf")
+        self._last_time = float("-inf")
+    
+    async def __call__(self, message: str, progress: float):
+        now = time.monotonic()
+        # Always forward completion so the final state is never dropped
+        if (
+            progress >= 1.0
+            or progress - self._last_progress >= self.min_delta
+            or now - self._last_time >= self.min_interval
+        ):
+            self._last_progress = progress
+            self._last_time = now
+            await self.callback(message, progress)
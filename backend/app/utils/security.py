@@ -1,36 +1,12 @@
 from fastapi import Request, HTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
-import time
 import logging
-from collections import defaultdict
-from typing import Dict, Tuple
 import os
+from app.utils.rate_limit import RateLimiter
+from app.utils.monitoring import system_monitor
 
 logger = logging.getLogger(__name__)
 
-class RateLimiter:
-    def __init__(self, requests_per_minute: int = 60):
-        self.requests_per_minute = requests_per_minute
-        self.requests: Dict[Tuple[str, str], list] = defaultdict(list)
-    
-    def is_allowed(self, ip: str, path: str) -> bool:
-        now = time.time()
-        minute_ago = now - 60
-        
-        # Clean old requests
-        self.requests[(ip, path)] = [
-            req_time for req_time in self.requests[(ip, path)]
-            if req_time > minute_ago
-        ]
-        
-        # Check if under limit
-        if len(self.requests[(ip, path)]) >= self.requests_per_minute:
-            return False
-        
-        # Add new request
-        self.requests[(ip, path)].append(now)
-        return True
-
 class SecurityMiddleware(BaseHTTPMiddleware):
     def __init__(
         self,
@@ -41,10 +17,27 @@ class SecurityMiddleware(BaseHTTPMiddleware):
     ):
         super().__init__(app)
         self.rate_limiter = RateLimiter(rate_limit_requests)
-        self.allowed_hosts = allowed_hosts or ["localhost", "127.0.0.1"]
+        self.allowed_hosts = frozenset(allowed_hosts or ("localhost", "127.0.0.1"))
+        # High-frequency probes that skip rate limiting
+        self._rate_limit_exempt = frozenset({"/api/health", "/api/system/metrics", "/docs", "/openapi.json"})
         self.enable_cors = enable_cors
         
     async def dispatch(self, request: Request, call_next):
+        # Record request metrics around the whole middleware stack
+        metrics = system_monitor.start_request(
+            path=request.url.path,
+            method=request.method
+        )
+        
+        try:
+            response = await self._dispatch(request, call_next)
+            system_monitor.end_request(metrics, status_code=response.status_code)
+            return response
+        except Exception as e:
+            system_monitor.end_request(metrics, status_code=getattr(e, "status_code", 500), error=str(e))
+            raise
+        
+    async def _dispatch(self, request: Request, call_next):
         # Get client IP
         client_ip = request.client.host if request.client else "0.0.0.0"
         
@@ -55,7 +48,7 @@ class SecurityMiddleware(BaseHTTPMiddleware):
             raise HTTPException(status_code=403, detail="Host not allowed")
         
         # Rate limiting
-        if not self.rate_limiter.is_allowed(client_ip, request.url.path):
+        if request.url.path not in self._rate_limit_exempt and self.rate_limiter.is_rate_limited(client_ip, request.url.path):
             logger.warning(f"Rate limit exceeded for IP {client_ip} on path {request.url.path}")
             raise HTTPException(status_code=429, detail="Too many requests")
         
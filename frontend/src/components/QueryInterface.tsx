@@ -170,7 +170,7 @@ const QueryInterface = ({ documentId }: Props) => {
                 <div key={index} className="p-3 border border-gray-200 rounded">
                   <p className="text-sm text-gray-600">{source.text}</p>
                   <p className="text-xs text-gray-500 mt-1">
-                    Relevance Score: {(1 - source.similarity_score).toFixed(3)}
+                    Relevance Score: {source.similarity_score.toFixed(3)}
                   </p>
                 </div>
               ))}
@@ -183,7 +183,7 @@ const QueryInterface = ({ documentId }: Props) => {
             <div>Chunks Used: {result.metadata.chunks_used}</div>
             <div>Total Tokens: {result.metadata.total_tokens}</div>
             <div>Device: {result.metadata.device}</div>
-            <div>Average Similarity Score: {(1 - result.metadata.avg_similarity_score).toFixed(3)}</div>
+            <div>Average Similarity Score: {result.metadata.avg_similarity_score.toFixed(3)}</div>
           </div>
         </div>
       )}